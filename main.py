@@ -1,23 +1,31 @@
 import pygame
 import numpy as np
-import math
-import random
 import datetime
-import os
 import imageio
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from numba import config, get_thread_id, njit, prange
 
 # Recording variables
 is_recording = False
-frame_count = 0
-frames_dir = "frames"
-os.makedirs(frames_dir, exist_ok=True)
 frames_per_stage = 10
+max_pending_frames = 8  # Capture blocks once this many frames await encoding
 
 # Constants
 WIDTH, HEIGHT = 800, 800
 G = 1  # Gravitational constant (larger = stronger attraction)
 THETA = 0.5  # Barnes-Hut parameter (larger = faster, but larger error)
+THETA2 = THETA * THETA
 DT = 0.1  # Time step (larger = slower, but more precise position incrementation)
+EPS2 = 1.0  # Squared softening length (larger = gentler close encounters)
+NUM_BODIES = 500
+TRAIL_FADE = 3  # Trail alpha lost per frame (255 / 3 = ~85 frame trails)
+MAX_TRAIL_SAMPLES = 32  # Max points stamped along a body's path per frame
+STACK_SIZE = 256  # Max pending nodes per body during the tree walk
+CELL_KEY_STRIDE = 1 << 32  # Packs a collision grid cell (x, y) into one int64
+MAX_DEPTH = 32  # Deepest quadtree level; deeper bodies share a leaf
+REORDER_INTERVAL = 16  # Frames between Morton reorderings of the body arrays
 
 # Pygame setup
 pygame.init()
@@ -26,194 +34,475 @@ pygame.display.set_caption("2D N-Body Simulation with Barnes-Hut")
 clock = pygame.time.Clock()
 
 
-# Body class
-class Body:
-    def __init__(self, x, y, mass, vx=0, vy=0):
-        self.x = x
-        self.y = y
-        self.mass = mass
-        self.vx = vx
-        self.vy = vy
-        self.radius = max(2, int(math.log(mass)))
-        self.trail = []
+# Bodies stored as parallel arrays (structure of arrays)
+@dataclass
+class BodyArray:
+    x: np.ndarray
+    y: np.ndarray
+    vx: np.ndarray
+    vy: np.ndarray
+    mass: np.ndarray
+    inv_mass: np.ndarray
+    radius: np.ndarray
+
+    @classmethod
+    def random(cls, n):
+        x = np.random.uniform(0, WIDTH, n)
+        y = np.random.uniform(0, HEIGHT, n)
+        mass = np.random.uniform(1, 10, n)
+        return cls(
+            x=x,
+            y=y,
+            vx=np.zeros(n),
+            vy=np.zeros(n),
+            mass=mass,
+            inv_mass=1.0 / mass,
+            radius=np.maximum(2, np.log(mass).astype(np.int32)),
+        )
 
-    def draw(self, screen):
-        pygame.draw.circle(screen, (0, 0, 0), (int(self.x), int(self.y)), self.radius)
+    def __len__(self):
+        return len(self.x)
+
+    # Permute every per-body array, e.g. to restore spatial locality
+    def reorder(self, perm):
+        self.x = self.x[perm]
+        self.y = self.y[perm]
+        self.vx = self.vx[perm]
+        self.vy = self.vy[perm]
+        self.mass = self.mass[perm]
+        self.inv_mass = self.inv_mass[perm]
+        self.radius = self.radius[perm]
+
+    def draw(self, screen, xy, sprites):
+        screen.blits(
+            [
+                (sprites[r], (x - r, y - r))
+                for (x, y), r in zip(xy.tolist(), self.radius.tolist())
+            ],
+            doreturn=False,
+        )
 
     def draw_velocity(self, screen):
-        arrow_length = math.sqrt(self.vx**2 + self.vy**2) * 5
-        if arrow_length > 0:
-            end_x = self.x + self.vx * 5
-            end_y = self.y + self.vy * 5
-            pygame.draw.line(screen, (0, 255, 0), (self.x, self.y), (end_x, end_y), 1)
-
-    def draw_trail(self, screen):
-        if len(self.trail) >= 2:
-            for i in range(1, len(self.trail)):
-                alpha = int(255 * (i / len(self.trail)))
-                color = (100, 100, 100, alpha)
-                start_pos = self.trail[i - 1]
-                end_pos = self.trail[i]
-                pygame.draw.line(screen, color, start_pos, end_pos, 1)
-
-    def update_position(self):
-        self.x += self.vx * DT
-        self.y += self.vy * DT
-        self.trail.append((int(self.x), int(self.y)))
-        if len(self.trail) > 100:
-            self.trail.pop(0)
-
-    def apply_force(self, fx, fy):
-        self.vx += fx / self.mass * DT
-        self.vy += fy / self.mass * DT
-
-
-# Barnes-Hut QuadTree Node
-class QuadTreeNode:
-    def __init__(self, x, y, width, height):
-        self.x = x
-        self.y = y
-        self.width = width
-        self.height = height
-        self.bodies = []
-        self.children = []
-        self.total_mass = 0
-        self.center_of_mass = (0, 0)
-
-    def insert(self, body):
-        if not self._contains(body):
-            return False
+        moving = (self.vx != 0) | (self.vy != 0)
+        end_x = self.x + self.vx * 5
+        end_y = self.y + self.vy * 5
+        starts = np.column_stack((self.x, self.y))[moving].tolist()
+        ends = np.column_stack((end_x, end_y))[moving].tolist()
+        for start_pos, end_pos in zip(starts, ends):
+            pygame.draw.line(screen, (0, 255, 0), start_pos, end_pos, 1)
+
+
+# Trails live on one persistent translucent layer: every frame it fades a
+# little and the bodies' latest paths are stamped in, then it is blitted once
+class TrailLayer:
+    def __init__(self, width, height):
+        self.surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.clear()
+
+    def clear(self):
+        self.surface.fill((100, 100, 100, 0))
+
+    def update(self, start, end):
+        self.surface.fill((0, 0, 0, TRAIL_FADE), special_flags=pygame.BLEND_RGBA_SUB)
+
+        # Enough points along each path (from start to end) to leave no gaps
+        longest = np.abs(end - start).max(initial=0)
+        samples = int(min(longest, MAX_TRAIL_SAMPLES)) + 1
+        t = np.linspace(0, 1, samples)[:, None, None]
+        points = (start + (end - start) * t).reshape(-1, 2).astype(np.int32)
+        width, height = self.surface.get_size()
+        on_screen = (
+            (points[:, 0] >= 0)
+            & (points[:, 0] < width)
+            & (points[:, 1] >= 0)
+            & (points[:, 1] < height)
+        )
+        points = points[on_screen]
 
-        if len(self.bodies) < 1:
-            self.bodies.append(body)
-            self._update_mass(body)
-            return True
+        alpha = pygame.surfarray.pixels_alpha(self.surface)
+        alpha[points[:, 0], points[:, 1]] = 255
+        del alpha  # Unlock the surface
 
-        if not self.children:
-            self._subdivide()
+    def draw(self, screen):
+        screen.blit(self.surface, (0, 0))
 
-        for child in self.children:
-            if child.insert(body):
-                return True
 
-        return False
+# Spreads the 8 bits of a byte to the even bit positions of a 16-bit value
+MORTON_LUT = np.zeros(256, dtype=np.uint32)
+for bit in range(8):
+    MORTON_LUT |= ((np.arange(256, dtype=np.uint32) >> bit) & 1) << (2 * bit)
 
-    def _contains(self, body):
-        return (
-            self.x <= body.x < self.x + self.width
-            and self.y <= body.y < self.y + self.height
-        )
 
-    def _subdivide(self):
-        half_width = self.width / 2
-        half_height = self.height / 2
-        self.children = [
-            QuadTreeNode(self.x, self.y, half_width, half_height),
-            QuadTreeNode(self.x + half_width, self.y, half_width, half_height),
-            QuadTreeNode(self.x, self.y + half_height, half_width, half_height),
-            QuadTreeNode(
-                self.x + half_width, self.y + half_height, half_width, half_height
-            ),
-        ]
-
-    def _update_mass(self, body):
-        self.total_mass += body.mass
-        self.center_of_mass = (
-            (
-                self.center_of_mass[0] * (self.total_mass - body.mass)
-                + body.x * body.mass
-            )
-            / self.total_mass,
-            (
-                self.center_of_mass[1] * (self.total_mass - body.mass)
-                + body.y * body.mass
-            )
-            / self.total_mass,
-        )
-
-    def compute_force(self, body):
-        if not self.bodies:
-            return 0, 0
+# Order that sorts bodies along a Z-order curve, so bodies close in space
+# end up close in memory and visit the same tree nodes one after another
+def morton_order(x, y):
+    qx = np.clip(x * (0xFFFF / WIDTH), 0, 0xFFFF).astype(np.uint32)
+    qy = np.clip(y * (0xFFFF / HEIGHT), 0, 0xFFFF).astype(np.uint32)
+    codes = (
+        (MORTON_LUT[qx >> 8] << 16)
+        | MORTON_LUT[qx & 0xFF]
+        | (MORTON_LUT[qy >> 8] << 17)
+        | (MORTON_LUT[qy & 0xFF] << 1)
+    )
+    return np.argsort(codes, kind="stable")
 
-        dx = self.center_of_mass[0] - body.x
-        dy = self.center_of_mass[1] - body.y
-        distance_sq = dx * dx + dy * dy
 
-        if distance_sq < 1e-10:
-            return 0, 0
+# Pre-rendered body sprite, blitted instead of rasterizing a circle per body
+def make_circle_surface(radius):
+    surface = pygame.Surface((2 * radius + 1, 2 * radius + 1), pygame.SRCALPHA)
+    pygame.draw.circle(surface, (0, 0, 0), (radius, radius), radius)
+    return surface
 
-        if self.width * self.width / distance_sq < THETA * THETA or not self.children:
-            force_magnitude = G * self.total_mass * body.mass / distance_sq
-            force_x = force_magnitude * dx / math.sqrt(distance_sq)
-            force_y = force_magnitude * dy / math.sqrt(distance_sq)
-            return force_x, force_y
 
-        force_x, force_y = 0, 0
-        for child in self.children:
-            fx, fy = child.compute_force(body)
-            force_x += fx
-            force_y += fy
-        return force_x, force_y
+# Barnes-Hut QuadTree, stored as a node arena reused across frames
+class QuadTree:
+    def __init__(self, width, height, capacity):
+        self.width = width
+        self.height = height
+        self.nodes_xywh = np.empty((capacity, 4), dtype=np.float64)
+        self.nodes_moments = np.empty((capacity, 3), dtype=np.float64)  # m*x, m*y, m
+        self.nodes_com = np.empty((capacity, 3), dtype=np.float64)  # com_x, com_y, mass
+        self.nodes_children = np.empty((capacity, 4), dtype=np.int32)  # -1 for leaves
+        self.next_node = 0
+        self.reset()
+
+    def reset(self):
+        self.next_node = 0
+        self._new_node(0, 0, self.width, self.height)
+
+    # Built one level at a time: every body still sharing a node is split
+    # into child quadrants in a single vectorized pass per level. Each leaf
+    # ends up holding at most one body
+    def build(self, x, y, mass):
+        self.reset()
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        x, y, mass = x[inside], y[inside], mass[inside]
+        node_of = np.zeros(len(x), dtype=np.intp)
+
+        for depth in range(MAX_DEPTH + 1):
+            n = self.next_node
+            self.nodes_moments[:n, 0] += np.bincount(node_of, x * mass, minlength=n)
+            self.nodes_moments[:n, 1] += np.bincount(node_of, y * mass, minlength=n)
+            self.nodes_moments[:n, 2] += np.bincount(node_of, mass, minlength=n)
+
+            # Bodies alone in their node are done. At MAX_DEPTH, (nearly)
+            # coincident bodies stay together in a leaf with their combined mass
+            shared = np.bincount(node_of, minlength=n)[node_of] > 1
+            if depth == MAX_DEPTH or not shared.any():
+                break
+
+            x, y, mass = x[shared], y[shared], mass[shared]
+            node_of = node_of[shared]
+            self._subdivide(np.unique(node_of))
+
+            node_x, node_y, width, height = self.nodes_xywh[node_of].T
+            quadrant = (x >= node_x + width / 2) + 2 * (y >= node_y + height / 2)
+            node_of = self.nodes_children[node_of, quadrant].astype(np.intp)
+
+        self.finalize()
+
+    # Turn accumulated moments into centers of mass once the tree is built
+    def finalize(self):
+        n = self.next_node
+        moments = self.nodes_moments[:n]
+        com = self.nodes_com[:n]
+        com[:, 2] = moments[:, 2]
+        com[:, :2] = 0
+        np.divide(
+            moments[:, :2], moments[:, 2:], out=com[:, :2], where=moments[:, 2:] > 0
+        )
 
+    # Active slice of the arena, as consumed by step
+    def arrays(self):
+        n = self.next_node
+        return self.nodes_xywh[:n], self.nodes_com[:n], self.nodes_children[:n]
+
+    def _new_node(self, x, y, width, height):
+        if self.next_node == len(self.nodes_xywh):
+            self._grow()
+        node = self.next_node
+        self.nodes_xywh[node] = (x, y, width, height)
+        self.nodes_moments[node] = 0
+        self.nodes_children[node] = -1
+        self.next_node += 1
+        return node
+
+    def _grow(self):
+        capacity = 2 * len(self.nodes_xywh)
+        for name in (
+            "nodes_xywh",
+            "nodes_moments",
+            "nodes_com",
+            "nodes_children",
+        ):
+            old = getattr(self, name)
+            new = np.empty((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[: len(old)] = old
+            setattr(self, name, new)
+
+    # Give each node four consecutive child slots, all at once
+    def _subdivide(self, nodes):
+        first = self.next_node
+        self.next_node += 4 * len(nodes)
+        while self.next_node > len(self.nodes_xywh):
+            self._grow()
+
+        children = first + 4 * np.arange(len(nodes))[:, None] + np.arange(4)
+        self.nodes_children[nodes] = children
+
+        x, y, width, height = self.nodes_xywh[nodes].T
+        half_width = width / 2
+        half_height = height / 2
+        new = slice(first, self.next_node)
+        child_xywh = self.nodes_xywh[new].reshape(-1, 4, 4)
+        child_xywh[:, :, 0] = x[:, None] + half_width[:, None] * (0, 1, 0, 1)
+        child_xywh[:, :, 1] = y[:, None] + half_height[:, None] * (0, 0, 1, 1)
+        child_xywh[:, :, 2] = half_width[:, None]
+        child_xywh[:, :, 3] = half_height[:, None]
+        self.nodes_moments[new] = 0
+        self.nodes_children[new] = -1
+
+    # Children tile their parent, so the root outline plus one cross through
+    # each internal node traces every cell. Leaves (empty or not) add no lines
     def draw(self, screen):
-        pygame.draw.rect(
-            screen, (102, 153, 255), (self.x, self.y, self.width, self.height), 1
+        color = (102, 153, 255)
+        pygame.draw.rect(screen, color, (0, 0, self.width, self.height), 1)
+
+        n = self.next_node
+        internal = self.nodes_children[:n, 0] != -1
+        x, y, width, height = self.nodes_xywh[:n][internal].T
+        mid_x = x + width / 2
+        mid_y = y + height / 2
+        # One vertical and one horizontal segment per internal node
+        segments = np.stack(
+            (mid_x, y, mid_x, y + height, x, mid_y, x + width, mid_y), axis=1
         )
-        for child in self.children:
-            child.draw(screen)
-
-
-# Collision handling
-def handle_collisions(bodies, e=0.8):
-    for i in range(len(bodies)):
-        for j in range(i + 1, len(bodies)):
-            body1 = bodies[i]
-            body2 = bodies[j]
-
-            dx = body2.x - body1.x
-            dy = body2.y - body1.y
-            distance = math.sqrt(dx * dx + dy * dy)
+        for start, end in segments.astype(np.int32).reshape(-1, 2, 2).tolist():
+            pygame.draw.line(screen, color, start, end)
+
+
+# Barnes-Hut force on one body, walking the tree arena with an explicit stack
+@njit(cache=True, fastmath=True, boundscheck=False)
+def walk_tree(
+    x, y, mass, nodes_xywh, nodes_com, nodes_children, theta2, g, eps2, stack
+):
+    g_mb = g * mass  # Invariant over the walk
+    stack[0] = 0
+    top = 1
+    force_x = 0.0
+    force_y = 0.0
+    while top > 0:
+        top -= 1
+        node = stack[top]
+        node_mass = nodes_com[node, 2]
+        if node_mass == 0:
+            continue
+
+        dx = nodes_com[node, 0] - x
+        dy = nodes_com[node, 1] - y
+        distance_sq = dx * dx + dy * dy
 
-            min_distance = body1.radius + body2.radius
-            if distance < min_distance:
-                nx = dx / distance
-                ny = dy / distance
+        width = nodes_xywh[node, 2]
+        if width * width < theta2 * distance_sq or nodes_children[node, 0] == -1:
+            # Softened 1/r^3 from a single square root; no self-interaction
+            # check needed since dx = dy = 0 yields zero force
+            dist_sqr = distance_sq + eps2
+            dist_sixth = dist_sqr * dist_sqr * dist_sqr
+            inv_dist_cube = 1.0 / np.sqrt(dist_sixth)
+            s = g_mb * node_mass * inv_dist_cube
+            force_x += s * dx
+            force_y += s * dy
+        else:
+            for k in range(4):
+                stack[top] = nodes_children[node, k]
+                top += 1
+
+    return force_x, force_y
+
+
+# One tree-walk stack per Numba thread, allocated once rather than per body.
+# Sized here instead of inside step, since a thread-count lookup in the kernel
+# would stop Numba from caching it
+def new_walk_stacks():
+    return np.empty((config.NUMBA_NUM_THREADS, STACK_SIZE), dtype=np.int32)
+
+
+# Fused simulation step: force walk, then velocity and position update, all
+# while the body's state is in registers. Bodies are independent here (the
+# tree is read-only), so they are spread across threads with prange
+@njit(cache=True, fastmath=True, parallel=True, boundscheck=False)
+def step(
+    bx,
+    by,
+    bvx,
+    bvy,
+    bm,
+    b_inv_m,
+    nodes_xywh,
+    nodes_com,
+    nodes_children,
+    theta2,
+    g,
+    eps2,
+    dt,
+    stacks,
+    out_xy,
+):
+    for i in prange(len(bx)):
+        force_x, force_y = walk_tree(
+            bx[i],
+            by[i],
+            bm[i],
+            nodes_xywh,
+            nodes_com,
+            nodes_children,
+            theta2,
+            g,
+            eps2,
+            stacks[get_thread_id()],
+        )
 
-                v_rel_x = body1.vx - body2.vx
-                v_rel_y = body1.vy - body2.vy
+        bvx[i] += force_x * b_inv_m[i] * dt
+        bvy[i] += force_y * b_inv_m[i] * dt
+        bx[i] += bvx[i] * dt
+        by[i] += bvy[i] * dt
+        out_xy[i, 0] = int(bx[i])
+        out_xy[i, 1] = int(by[i])
 
-                v_rel_dot_n = v_rel_x * nx + v_rel_y * ny
 
-                J = (1 + e) * v_rel_dot_n / (1 / body1.mass + 1 / body2.mass)
+# Collision handling
+def handle_collisions(bodies, e=0.8):
+    handle_collisions_jit(
+        bodies.x, bodies.y, bodies.vx, bodies.vy, bodies.inv_mass, bodies.radius, e
+    )
 
-                body1.vx -= J * nx / body1.mass
-                body1.vy -= J * ny / body1.mass
-                body2.vx += J * nx / body2.mass
-                body2.vy += J * ny / body2.mass
 
-                # Add minor buffer (sometimes bodies overlap...)
-                overlap = min_distance - distance
-                body1.x -= overlap * nx / 2
-                body1.y -= overlap * ny / 2
-                body2.x += overlap * nx / 2
-                body2.y += overlap * ny / 2
+# Broad phase buckets bodies into a uniform grid of cells at least one
+# diameter wide, so only bodies in the 3x3 neighbouring cells are tested
+@njit(cache=True, boundscheck=False)
+def handle_collisions_jit(x, y, vx, vy, inv_mass, radius, e):
+    cell = 2 * radius.max() + 1
+    cell_x = np.floor(x / cell).astype(np.int64)
+    cell_y = np.floor(y / cell).astype(np.int64)
+    keys = cell_x * CELL_KEY_STRIDE + cell_y
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+
+    for i in range(len(x)):
+        for offset_x in range(-1, 2):
+            for offset_y in range(-1, 2):
+                key = (cell_x[i] + offset_x) * CELL_KEY_STRIDE + cell_y[i] + offset_y
+                start = np.searchsorted(sorted_keys, key)
+                end = np.searchsorted(sorted_keys, key, side="right")
+                for k in range(start, end):
+                    j = order[k]
+                    if j <= i:
+                        continue
+
+                    dx = x[j] - x[i]
+                    dy = y[j] - y[i]
+                    distance_sq = dx * dx + dy * dy
+
+                    min_distance = radius[i] + radius[j]
+                    if distance_sq >= min_distance * min_distance or distance_sq == 0:
+                        continue
+
+                    distance = np.sqrt(distance_sq)
+                    inv_distance = 1.0 / distance
+                    nx = dx * inv_distance
+                    ny = dy * inv_distance
+
+                    v_rel_x = vx[i] - vx[j]
+                    v_rel_y = vy[i] - vy[j]
+
+                    v_rel_dot_n = v_rel_x * nx + v_rel_y * ny
+
+                    J = (1 + e) * v_rel_dot_n / (inv_mass[i] + inv_mass[j])
+
+                    vx[i] -= J * nx * inv_mass[i]
+                    vy[i] -= J * ny * inv_mass[i]
+                    vx[j] += J * nx * inv_mass[j]
+                    vy[j] += J * ny * inv_mass[j]
+
+                    # Add minor buffer (sometimes bodies overlap...)
+                    overlap = min_distance - distance
+                    x[i] -= overlap * nx / 2
+                    y[i] -= overlap * ny / 2
+                    x[j] += overlap * nx / 2
+                    y[j] += overlap * ny / 2
+
+
+# Streams captured frames straight into the GIF encoder on a worker thread
+class FrameWriter:
+    def __init__(self, output_file, max_pending=max_pending_frames):
+        self.output_file = output_file
+        self.queue = queue.Queue(maxsize=max_pending)
+        # A single worker, since GIF frames must be appended in order
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.worker = self.executor.submit(self._run)
+
+    def submit(self, surface):
+        # array3d copies the pixels, so the screen can be redrawn right away
+        self._put(pygame.surfarray.array3d(surface))
+
+    def close(self):
+        self._put(None)
+        self.executor.shutdown(wait=True)
+        frames_written = self.worker.result()
+        if frames_written:
+            print(f"GIF saved as {self.output_file}")
+        else:
+            print("No frames to compile.")
+
+    # Blocks while the queue is full, but re-raises the worker's error as soon
+    # as it stops, so a failed encoder can't leave the main loop waiting forever
+    def _put(self, item):
+        while True:
+            if self.worker.done():
+                self.worker.result()
+                raise RuntimeError("Frame writer has already been closed")
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _run(self):
+        frames_written = 0
+        writer = None
+        try:
+            while True:
+                frame = self.queue.get()
+                if frame is None:
+                    return frames_written
+                if writer is None:
+                    writer = imageio.get_writer(self.output_file, mode="I", fps=30)
+                writer.append_data(frame.swapaxes(0, 1))
+                frames_written += 1
+        finally:
+            if writer is not None:
+                writer.close()
 
 
 def main():
-    bodies = [
-        Body(random.uniform(0, WIDTH), random.uniform(0, HEIGHT), random.uniform(1, 10))
-        for _ in range(500)
-    ]
+    bodies = BodyArray.random(NUM_BODIES)
+    tree = QuadTree(WIDTH, HEIGHT, 4 * NUM_BODIES)
+    xy = np.empty((NUM_BODIES, 2), dtype=np.int32)  # Integer screen coordinates
+    stacks = new_walk_stacks()
+    trails = TrailLayer(WIDTH, HEIGHT)
+    radius_sprites = {
+        r: make_circle_surface(r) for r in np.unique(bodies.radius).tolist()
+    }
 
     show_velocity = False
     show_quadtree = False
     show_trails = False
 
-    global is_recording, frame_count
+    global is_recording
     is_recording = False
-    frame_count = 0
     simulation_steps = 0
     running = True
+    frame_writer = None
 
     while running:
         for event in pygame.event.get():
@@ -231,76 +520,67 @@ def main():
                     print(f"Screenshot saved as {filename}")
                 if event.key == pygame.K_t:
                     show_trails = not show_trails
+                    trails.clear()
                 if event.key == pygame.K_r:
                     is_recording = not is_recording
                     if is_recording:
+                        frame_writer = FrameWriter("simulation.gif")
                         print("Recording started...")
                     else:
                         print("Recording stopped. Compiling frames...")
-                        compile_frames_to_gif()
-                        frame_count = 0
+                        frame_writer.close()
+                        frame_writer = None
         screen.fill((255, 255, 255))
 
-        root = QuadTreeNode(0, 0, WIDTH, HEIGHT)
-        for body in bodies:
-            root.insert(body)
+        if simulation_steps % REORDER_INTERVAL == 0:
+            bodies.reorder(morton_order(bodies.x, bodies.y))
+
+        tree.build(bodies.x, bodies.y, bodies.mass)
 
         if show_quadtree:
-            root.draw(screen)
+            tree.draw(screen)
 
         if show_trails:
-            for body in bodies:
-                body.draw_trail(screen)
-
-        for body in bodies:
-            fx, fy = root.compute_force(body)
-            body.apply_force(fx, fy)
-            body.update_position()
-            body.draw(screen)
-            if show_velocity:
-                body.draw_velocity(screen)
+            start = np.column_stack((bodies.x, bodies.y))
+
+        step(
+            bodies.x,
+            bodies.y,
+            bodies.vx,
+            bodies.vy,
+            bodies.mass,
+            bodies.inv_mass,
+            *tree.arrays(),
+            THETA2,
+            G,
+            EPS2,
+            DT,
+            stacks,
+            xy,
+        )
+        if show_trails:
+            trails.update(start, np.column_stack((bodies.x, bodies.y)))
+            trails.draw(screen)
+        bodies.draw(screen, xy, radius_sprites)
+        if show_velocity:
+            bodies.draw_velocity(screen)
 
         # Handle collisions after every step
         handle_collisions(bodies)
 
         # Capture frame if recording and at the right stage
         if is_recording and simulation_steps % frames_per_stage == 0:
-            frame_filename = os.path.join(frames_dir, f"frame_{frame_count:04d}.png")
-            pygame.image.save(screen, frame_filename)
-            frame_count += 1
+            frame_writer.submit(screen)
 
         simulation_steps += 1
 
         pygame.display.flip()
         clock.tick(60)
 
+    if frame_writer is not None:
+        frame_writer.close()
     pygame.quit()
 
 
-def compile_frames_to_gif():
-    frame_files = sorted(
-        [
-            os.path.join(frames_dir, f)
-            for f in os.listdir(frames_dir)
-            if f.startswith("frame_")
-        ]
-    )
-    if not frame_files:
-        print("No frames to compile.")
-        return
-
-    output_file = "simulation.gif"
-    with imageio.get_writer(output_file, mode="I", fps=30) as writer:
-        for frame_file in frame_files:
-            image = imageio.imread(frame_file)
-            writer.append_data(image)
-        print(f"GIF saved as {output_file}")
-
-    # Wipe frames after gif is created
-    for frame_file in frame_files:
-        os.remove(frame_file)
-    print("Frames cleaned up.")
-
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,39 @@
+# Runs every Numba kernel once on representative arrays, so the compiled
+# machine code lands in __pycache__ and later runs of main.py load it from
+# disk instead of JIT-compiling on the first frame
+import os
+
+# Compile without opening a window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import main
+
+
+def precompile():
+    bodies = main.BodyArray.random(main.NUM_BODIES)
+    tree = main.QuadTree(main.WIDTH, main.HEIGHT, 4 * main.NUM_BODIES)
+    xy = np.empty((main.NUM_BODIES, 2), dtype=np.int32)
+
+    tree.build(bodies.x, bodies.y, bodies.mass)
+    main.step(
+        bodies.x,
+        bodies.y,
+        bodies.vx,
+        bodies.vy,
+        bodies.mass,
+        bodies.inv_mass,
+        *tree.arrays(),
+        main.THETA2,
+        main.G,
+        main.EPS2,
+        main.DT,
+        main.new_walk_stacks(),
+        xy,
+    )
+    main.handle_collisions(bodies)
+
+
+if __name__ == "__main__":
+    precompile()
+    print("Numba kernels compiled and cached.")